@@ -0,0 +1,115 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from app.utils import setup_logger
+
+# 设置日志
+logger = setup_logger(__name__)
+
+
+class BatchQueueFullError(RuntimeError):
+    """等待队列已满，调用方应稍后重试"""
+
+
+class BatchScheduler:
+    def __init__(
+        self,
+        handler: Callable[[str, Optional[str]], Awaitable[Dict[str, Any]]],
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+        max_queue_size: Optional[int] = None
+    ):
+        """
+        动态批处理调度器：把短时间内到达的抽取请求合并为一批并发发送
+        :param handler: 处理单个 (系统提示词, 用户提示词) 的协程函数，如 LLMKGExtractor.aextract
+        :param max_batch_size: 每批最多请求数
+        :param max_wait_ms: 凑批的最长等待时间（毫秒）
+        :param max_queue_size: 等待队列上限，超出时拒绝新请求
+        """
+        self.handler = handler
+        self.max_batch_size = max(max_batch_size or int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "8")), 1)
+        self.max_wait = (max_wait_ms if max_wait_ms is not None
+                         else float(os.getenv("INFERENCE_MAX_WAIT_MS", "20"))) / 1000
+        self.max_queue_size = max_queue_size or int(os.getenv("INFERENCE_MAX_QUEUE_SIZE", "256"))
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+
+    async def start(self):
+        """启动后台凑批任务，需在事件循环中调用"""
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止调度器，取消未完成的请求"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        tasks = list(self._inflight)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(self._worker, *tasks, return_exceptions=True)
+        while not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            if not future.done():
+                future.cancel()
+        self._worker = None
+        self._queue = None
+
+    async def submit(self, prompt: str, user_prompt: Optional[str] = None) -> Dict[str, Any]:
+        """提交一个提示词并等待其抽取结果"""
+        if self._worker is None:
+            # 调度器未启动（如脚本直接调用）时退化为直接调用
+            return await self.handler(prompt, user_prompt)
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((prompt, user_prompt, future))
+        except asyncio.QueueFull:
+            raise BatchQueueFullError("抽取请求过多，请稍后重试")
+        return await future
+
+    async def _run(self):
+        """持续从队列中凑批并派发"""
+        while True:
+            batch = [await self._queue.get()]
+            # 队列中不足一批时等待一个窗口期再取，避免 wait_for 吞掉取消信号
+            if self._queue.qsize() < self.max_batch_size - 1 and self.max_wait > 0:
+                try:
+                    await asyncio.sleep(self.max_wait)
+                except asyncio.CancelledError:
+                    # 已出队但尚未派发的请求不在队列中，stop() 无法清理，需在此取消
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.cancel()
+                    raise
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[Tuple[str, Optional[str], asyncio.Future]]):
+        """并发执行一批请求，并把结果回填到各自的future"""
+        logger.info(f"Dispatching extraction batch of size {len(batch)}")
+        try:
+            results = await asyncio.gather(
+                *(self.handler(prompt, user_prompt) for prompt, user_prompt, _ in batch),
+                return_exceptions=True
+            )
+        except asyncio.CancelledError:
+            for _, _, future in batch:
+                if not future.done():
+                    future.cancel()
+            raise
+        except Exception as e:
+            # 处理函数在创建协程时就抛出异常，整批请求都以该异常结束
+            results = [e] * len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
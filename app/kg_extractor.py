@@ -1,42 +1,221 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import asyncio
 import os
-import json
-from typing import Dict, Any
+import orjson
+import httpx
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+from app.llm_cache import LLMResponseCache
 from app.utils import setup_logger
 
 # 设置日志
 logger = setup_logger(__name__)
 
 class LLMKGExtractor:
-    def __init__(self):
-        # 初始化OpenAI客户端
-        self.client = OpenAI(
-            base_url=os.getenv("LLM_API_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3"),
-            api_key=os.environ.get("ARK_API_KEY"),
-        )
+    def __init__(
+        self,
+        http_client: Optional[httpx.Client] = None,
+        async_http_client: Optional[httpx.AsyncClient] = None
+    ):
+        """
+        :param http_client: 共享的同步httpx客户端，复用连接池与keep-alive
+        :param async_http_client: 共享的异步httpx客户端
+        """
+        self.base_url = os.getenv("LLM_API_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3")
+        self.api_key = os.environ.get("ARK_API_KEY")
+        # 初始化OpenAI客户端（同步与异步各一个）
+        self.set_http_clients(http_client, async_http_client)
         self.model = os.getenv("MODEL_NAME", "ep-20250716102319-wdqpt")
+        # 要求模型以JSON对象格式输出，服务端不支持时可通过环境变量关闭
+        self.json_mode = os.getenv("LLM_JSON_MODE", "true").lower() in ("1", "true", "yes")
+        # 结果缓存：相同提示词直接返回；配置向量模型后额外启用语义匹配
+        self.embedding_model = os.getenv("EMBEDDING_MODEL")
+        self.cache = LLMResponseCache(
+            maxsize=int(os.getenv("LLM_CACHE_SIZE", "10000")),
+            similarity_threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+        )
+
+    def set_http_clients(
+        self,
+        http_client: Optional[httpx.Client] = None,
+        async_http_client: Optional[httpx.AsyncClient] = None
+    ):
+        """
+        使用给定的httpx客户端重建OpenAI客户端，传入None时使用OpenAI自带的连接池
+        :param http_client: 共享的同步httpx客户端
+        :param async_http_client: 共享的异步httpx客户端
+        """
+        self.client = OpenAI(base_url=self.base_url, api_key=self.api_key, http_client=http_client)
+        self.aclient = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, http_client=async_http_client)
 
-    def extract(self, prompt: str) -> Dict[str, Any]:
+    def extract(self, prompt: str, user_prompt: Optional[str] = None) -> Dict[str, Any]:
         """
         调用LLM进行知识图谱抽取
-        :param prompt: 渲染后的提示词字符串
+        :param prompt: 渲染后的提示词字符串，作为系统消息发送
+        :param user_prompt: 可选的用户消息（包含输入文本的动态部分）
         :return: 解析后的JSON结果
         """
+        cached = self._cache_lookup(prompt, user_prompt)
+        if cached is not None:
+            return cached
+        embedding = self._embed(user_prompt) if self._semantic_enabled(user_prompt) else None
+        if embedding is not None:
+            cached = self._semantic_lookup(prompt, embedding)
+            if cached is not None:
+                return cached
+
         try:
-            logger.info(f"Sending request to LLM with prompt length {len(prompt)}")
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": prompt}
-                ]
-            )
+            logger.info(f"Sending request to LLM with prompt length {len(prompt) + len(user_prompt or '')}")
+            response = self.client.chat.completions.create(**self._completion_kwargs(prompt, user_prompt))
             content = (response.choices[0].message.content or "").strip()
             logger.info(f"Received response from LLM: {content[:100]}...")  # 只打印前100个字符作为示例
-            return json.loads(content)
+            result = orjson.loads(content)
+        except Exception as e:
+            logger.error(f"Error during LLM call: {str(e)}")
+            raise ValueError("Failed to process the request through LLM.") from e
+
+        self._cache_store(prompt, user_prompt, result, embedding)
+        return result
+
+    async def aextract(self, prompt: str, user_prompt: Optional[str] = None) -> Dict[str, Any]:
+        """
+        异步调用LLM进行知识图谱抽取，供批量评估并发使用
+        :param prompt: 渲染后的提示词字符串，作为系统消息发送
+        :param user_prompt: 可选的用户消息（包含输入文本的动态部分）
+        :return: 解析后的JSON结果
+        """
+        cached = self._cache_lookup(prompt, user_prompt)
+        if cached is not None:
+            return cached
+        embedding = await self._aembed(user_prompt) if self._semantic_enabled(user_prompt) else None
+        if embedding is not None:
+            # 相似度矩阵运算放到线程中，避免阻塞事件循环
+            cached = await asyncio.to_thread(self._semantic_lookup, prompt, embedding)
+            if cached is not None:
+                return cached
+
+        try:
+            logger.info(f"Sending async request to LLM with prompt length {len(prompt) + len(user_prompt or '')}")
+            response = await self.aclient.chat.completions.create(**self._completion_kwargs(prompt, user_prompt))
+            content = (response.choices[0].message.content or "").strip()
+            logger.info(f"Received response from LLM: {content[:100]}...")
+            result = orjson.loads(content)
         except Exception as e:
             logger.error(f"Error during LLM call: {str(e)}")
             raise ValueError("Failed to process the request through LLM.") from e
 
+        self._cache_store(prompt, user_prompt, result, embedding)
+        return result
+
+
+    async def aextract_stream(self, prompt: str, user_prompt: Optional[str] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        流式调用LLM进行知识图谱抽取
+        :param prompt: 渲染后的提示词字符串，作为系统消息发送
+        :param user_prompt: 可选的用户消息（包含输入文本的动态部分）
+        :return: 依次产出 ("delta", 文本片段)，最后产出 ("result", 解析后的JSON结果)
+        """
+        cached = self._cache_lookup(prompt, user_prompt)
+        if cached is not None:
+            yield "result", cached
+            return
+
+        chunks: List[str] = []
+        try:
+            logger.info(f"Sending streaming request to LLM with prompt length {len(prompt) + len(user_prompt or '')}")
+            stream = await self.aclient.chat.completions.create(
+                **self._completion_kwargs(prompt, user_prompt), stream=True
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    chunks.append(delta)
+                    yield "delta", delta
+            content = "".join(chunks)
+            logger.info(f"Received streamed response from LLM: {content[:100]}...")
+            result = orjson.loads(content)
+        except Exception as e:
+            logger.error(f"Error during LLM call: {str(e)}")
+            raise ValueError("Failed to process the request through LLM.") from e
+
+        self._cache_store(prompt, user_prompt, result)
+        yield "result", result
+
+    def _cache_lookup(self, prompt: str, user_prompt: Optional[str]) -> Optional[Dict[str, Any]]:
+        """按完整提示词精确匹配缓存"""
+        if not self.cache.enabled:
+            return None
+        cached = self.cache.get(self.cache.make_key(prompt, user_prompt or ""))
+        if cached is not None:
+            logger.info("LLM cache hit")
+        return cached
+
+    def _semantic_enabled(self, user_prompt: Optional[str]) -> bool:
+        """是否需要计算输入文本向量做语义匹配"""
+        return self.cache.enabled and bool(self.embedding_model and user_prompt)
+
+    def _semantic_lookup(self, prompt: str, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """
+        语义匹配缓存
+        只比较输入文本部分，并限定在相同系统提示词内，避免共同的长前缀掩盖文本差异
+        """
+        cached = self.cache.get_similar(embedding, self.cache.make_key(prompt))
+        if cached is not None:
+            logger.info("LLM semantic cache hit")
+        return cached
+
+    def _cache_store(
+        self,
+        prompt: str,
+        user_prompt: Optional[str],
+        result: Dict[str, Any],
+        embedding: Optional[List[float]] = None
+    ):
+        """写入抽取结果；提供输入文本向量时同时写入所属系统提示词的语义索引"""
+        if not self.cache.enabled:
+            return
+        namespace = self.cache.make_key(prompt) if embedding is not None else None
+        self.cache.put(self.cache.make_key(prompt, user_prompt or ""), result, embedding, namespace)
+
+    def _completion_kwargs(self, prompt: str, user_prompt: Optional[str] = None) -> Dict[str, Any]:
+        """
+        构造chat.completions请求参数
+        静态的模板与schema放在系统消息中，输入文本放在用户消息中，使服务端前缀缓存可以命中
+        """
+        messages = []
+        # 模板以输入文本开头时静态前缀为空，不发送空的系统消息
+        if prompt:
+            messages.append({"role": "system", "content": prompt})
+        if user_prompt:
+            messages.append({"role": "user", "content": user_prompt})
+        kwargs: Dict[str, Any] = {
+            "model": self.model,
+            "messages": messages
+        }
+        # OpenAI兼容接口要求消息中出现 "json" 字样才能启用JSON模式，否则直接拒绝请求
+        if self.json_mode and "json" in f"{prompt}\n{user_prompt or ''}".lower():
+            kwargs["response_format"] = {"type": "json_object"}
+        return kwargs
+
+    def _embed(self, prompt: str) -> Optional[List[float]]:
+        """计算输入文本向量，失败时仅跳过语义缓存"""
+        try:
+            response = self.client.embeddings.create(model=self.embedding_model, input=prompt)
+            return response.data[0].embedding
+        except Exception as e:
+            logger.warning(f"Embedding request failed, semantic cache skipped: {str(e)}")
+            return None
+
+    async def _aembed(self, prompt: str) -> Optional[List[float]]:
+        """异步计算输入文本向量，失败时仅跳过语义缓存"""
+        try:
+            response = await self.aclient.embeddings.create(model=self.embedding_model, input=prompt)
+            return response.data[0].embedding
+        except Exception as e:
+            logger.warning(f"Embedding request failed, semantic cache skipped: {str(e)}")
+            return None
+
 
 if __name__ == "__main__":
     # 示例测试
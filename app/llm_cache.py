@@ -0,0 +1,150 @@
+import copy
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+
+class LLMResponseCache:
+    def __init__(self, maxsize: int = 10000, similarity_threshold: float = 0.95):
+        """
+        LLM 抽取结果缓存
+        - 第一层：以提示词 SHA256 为键的精确匹配 LRU
+        - 第二层（可选）：基于输入文本向量余弦相似度的语义匹配，只在同一系统提示词（命名空间）内查找
+        :param maxsize: 最大缓存条目数，<=0 表示禁用缓存
+        :param similarity_threshold: 语义命中所需的最小余弦相似度
+        """
+        self.maxsize = maxsize
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 命名空间 -> 向量索引；缓存键 -> 所属命名空间
+        self._indexes: Dict[str, "_VectorIndex"] = {}
+        self._key_namespaces: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    @staticmethod
+    def make_key(*prompts: str) -> str:
+        """计算提示词（可由多段消息组成）的缓存键"""
+        digest = hashlib.sha256()
+        for prompt in prompts:
+            digest.update(prompt.encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """精确匹配查询，返回结果副本以免调用方修改缓存内容"""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                return None
+            self._entries.move_to_end(key)
+        return copy.deepcopy(result)
+
+    def get_similar(self, embedding: List[float], namespace: str) -> Optional[Dict[str, Any]]:
+        """
+        语义匹配查询，返回同一命名空间内相似度最高且超过阈值的结果
+        矩阵运算可能耗时数毫秒，异步调用方应放到线程中执行
+        """
+        query = _normalize(embedding)
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                return None
+            best_key = index.best_match(query, self.similarity_threshold)
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            result = self._entries[best_key]
+        return copy.deepcopy(result)
+
+    def put(
+        self,
+        key: str,
+        result: Dict[str, Any],
+        embedding: Optional[List[float]] = None,
+        namespace: Optional[str] = None
+    ):
+        """写入缓存，超出容量时淘汰最久未使用的条目；提供向量与命名空间时同时写入语义索引"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = copy.deepcopy(result)
+            self._entries.move_to_end(key)
+            if embedding is not None and namespace is not None:
+                self._drop_vector(key)
+                index = self._indexes.get(namespace)
+                if index is None:
+                    index = self._indexes[namespace] = _VectorIndex()
+                index.add(key, _normalize(embedding))
+                self._key_namespaces[key] = namespace
+            while len(self._entries) > self.maxsize:
+                evicted, _ = self._entries.popitem(last=False)
+                self._drop_vector(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._indexes.clear()
+            self._key_namespaces.clear()
+
+    def _drop_vector(self, key: str):
+        """从语义索引中移除条目，调用方需持有锁"""
+        namespace = self._key_namespaces.pop(key, None)
+        if namespace is None:
+            return
+        index = self._indexes[namespace]
+        index.remove(key)
+        if not index.keys:
+            del self._indexes[namespace]
+
+
+class _VectorIndex:
+    """以 NumPy 矩阵保存归一化向量，一次矩阵乘法即可求出全部余弦相似度"""
+
+    def __init__(self):
+        self.keys: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.matrix: Optional[np.ndarray] = None
+
+    def add(self, key: str, vector: np.ndarray):
+        if self.matrix is None:
+            self.matrix = np.empty((16, vector.shape[0]), dtype=np.float32)
+        elif len(self.keys) == self.matrix.shape[0]:
+            # 容量不足时倍增，均摊追加成本
+            self.matrix = np.concatenate([self.matrix, np.empty_like(self.matrix)])
+        row = len(self.keys)
+        self.matrix[row] = vector
+        self.keys.append(key)
+        self.rows[key] = row
+
+    def remove(self, key: str):
+        # 用最后一行填补被删除的行，保持矩阵紧凑
+        row = self.rows.pop(key)
+        last = len(self.keys) - 1
+        if row != last:
+            moved = self.keys[last]
+            self.matrix[row] = self.matrix[last]
+            self.keys[row] = moved
+            self.rows[moved] = row
+        self.keys.pop()
+
+    def best_match(self, query: np.ndarray, threshold: float) -> Optional[str]:
+        if not self.keys or query.shape[0] != self.matrix.shape[1]:
+            return None
+        scores = self.matrix[:len(self.keys)] @ query
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            return None
+        return self.keys[best]
+
+
+def _normalize(vector: List[float]) -> np.ndarray:
+    """归一化向量，使点积即为余弦相似度"""
+    array = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(array)) or 1.0
+    return array / norm
@@ -1,8 +1,10 @@
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
 from app.schemas import (
     ExtractionRequest, 
     ExtractionResponse,
@@ -17,24 +19,66 @@ from app.schemas import (
 from app.prompt_manager import EnhancedPromptManager
 from app.prompt_evaluator import PromptEvaluator
 from app.kg_extractor import LLMKGExtractor
+from app.batching import BatchScheduler, BatchQueueFullError
+import httpx
 import logging
+import multiprocessing
+import orjson
 import os
 
-# 初始化FastAPI应用
-app = FastAPI(
-    title="知识图谱抽取API",
-    description="支持动态提示词管理的知识图谱抽取服务",
-    version="2.0.0"
-)
-
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 共享HTTP连接池的配置，连接池本身在应用生命周期内创建
+http_limits = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
 # 初始化组件
-prompt_manager = EnhancedPromptManager()
+prompt_manager = EnhancedPromptManager(os.getenv("PROMPT_STORAGE_FILE", "prompt_templates.json"))
 kg_extractor = LLMKGExtractor()
-prompt_evaluator = PromptEvaluator()
+prompt_evaluator = PromptEvaluator(kg_extractor=kg_extractor, prompt_manager=prompt_manager)
+batch_scheduler = BatchScheduler(kg_extractor.aextract)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：创建共享的HTTP连接池，启动抽取批处理调度器与评分进程池；退出时写入模板修改并关闭连接池"""
+    # 每次启动都新建连接池，所有LLM调用复用连接与keep-alive；重复进入生命周期时不会用到已关闭的客户端
+    app.state.http_client = httpx.Client(limits=http_limits, timeout=60)
+    app.state.async_http_client = httpx.AsyncClient(limits=http_limits, timeout=60)
+    kg_extractor.set_http_clients(app.state.http_client, app.state.async_http_client)
+    # 评分为纯CPU计算，交给进程池以利用多核；SCORING_WORKERS=0 时在线程中评分
+    scoring_workers = int(os.getenv("SCORING_WORKERS", str(os.cpu_count() or 1)))
+    # 不使用fork：此时事件循环与连接池线程已在运行，fork出的子进程可能继承被占用的锁
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    app.state.pool = ProcessPoolExecutor(
+        max_workers=scoring_workers, mp_context=multiprocessing.get_context(start_method)
+    ) if scoring_workers > 0 else None
+    prompt_evaluator.score_executor = app.state.pool
+    await batch_scheduler.start()
+    yield
+    await batch_scheduler.stop()
+    prompt_evaluator.score_executor = None
+    if app.state.pool is not None:
+        app.state.pool.shutdown(cancel_futures=True)
+    # 写入尚未落盘的模板修改；失败时记录日志，不影响后续的资源释放
+    try:
+        prompt_manager.flush()
+    except Exception as e:
+        logger.error(f"Error flushing prompt templates on shutdown: {str(e)}")
+    # 先让抽取器退回自带的客户端，再关闭本次生命周期的连接池
+    kg_extractor.set_http_clients()
+    app.state.http_client.close()
+    await app.state.async_http_client.aclose()
+
+
+# 初始化FastAPI应用
+app = FastAPI(
+    title="知识图谱抽取API",
+    description="支持动态提示词管理的知识图谱抽取服务",
+    version="2.0.0",
+    lifespan=lifespan
+)
 
 # 挂载静态文件
 if os.path.exists("templates"):
@@ -60,25 +104,60 @@ async def extract_knowledge_graph(extraction_request: ExtractionRequest) -> Extr
         logger.info(f"Extraction schema_info: {extraction_request.schema_info}")
         logger.info(f"Template ID: {extraction_request.template_id}")
         
-        # 使用增强的提示词管理器渲染提示词
-        prompt = prompt_manager.render_prompt(
+        # 使用增强的提示词管理器渲染提示词：静态的模板与schema作为系统消息，输入文本作为用户消息
+        prompt, user_prompt = prompt_manager.render_prompt_parts(
             language=extraction_request.language,
             text=extraction_request.text,
             schema_info=extraction_request.schema_info,
             template_id=extraction_request.template_id
         )
         
-        # 调用LLM进行知识图谱抽取
-        logger.info(f"Prompt: {prompt}")
-        result = kg_extractor.extract(prompt)
+        # 经批处理调度器异步调用LLM，并发请求会被合并成批发送
+        logger.info(f"Prompt: {prompt}{user_prompt}")
+        result = await batch_scheduler.submit(prompt, user_prompt)
         
         # 返回结果
         return ExtractionResponse(**result)
     
+    except BatchQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error during knowledge graph extraction: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/extract/stream")
+async def extract_knowledge_graph_stream(extraction_request: ExtractionRequest) -> StreamingResponse:
+    """
+    流式提取知识图谱接口（Server-Sent Events）
+    - delta 事件：模型输出的文本片段
+    - result 事件：完整的结构化知识图谱
+    - error 事件：抽取失败的错误信息
+    """
+    try:
+        prompt, user_prompt = prompt_manager.render_prompt_parts(
+            language=extraction_request.language,
+            text=extraction_request.text,
+            schema_info=extraction_request.schema_info,
+            template_id=extraction_request.template_id
+        )
+    except Exception as e:
+        logger.error(f"Error rendering prompt for streaming extraction: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def event_stream():
+        try:
+            async for event, payload in kg_extractor.aextract_stream(prompt, user_prompt):
+                if event == "result":
+                    data = ExtractionResponse(**payload).model_dump_json()
+                else:
+                    data = orjson.dumps(payload).decode("utf-8")
+                yield f"event: {event}\ndata: {data}\n\n"
+        except Exception as e:
+            logger.error(f"Error during streaming knowledge graph extraction: {str(e)}")
+            yield f"event: error\ndata: {orjson.dumps(str(e)).decode('utf-8')}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 # ==================== 提示词模板管理接口 ====================
 
 @app.post("/prompts", response_model=PromptTemplateResponse)
@@ -98,7 +177,8 @@ async def list_prompt_templates(
     tags: Optional[str] = Query(None, description="标签过滤，用逗号分隔"),
     keyword: Optional[str] = Query(None, description="关键词搜索"),
     page: int = Query(1, ge=1, description="页码"),
-    page_size: int = Query(10, ge=1, le=100, description="每页数量")
+    page_size: int = Query(10, ge=1, le=100, description="每页数量"),
+    after_id: Optional[str] = Query(None, description="游标：返回该模板之后的结果，指定时忽略页码")
 ) -> TemplateListResponse:
     """
     列出提示词模板
@@ -109,7 +189,8 @@ async def list_prompt_templates(
             tags=tags.split(",") if tags else None,
             keyword=keyword,
             page=page,
-            page_size=page_size
+            page_size=page_size,
+            after_id=after_id
         )
         return prompt_manager.list_templates(request)
     except Exception as e:
@@ -216,7 +297,7 @@ async def evaluate_prompt_template(
             raise HTTPException(status_code=404, detail="模板不存在")
         
         # 执行评估
-        return prompt_evaluator.evaluate_template(
+        return await prompt_evaluator.evaluate_template(
             template_id=template_id,
             template_name=template.name,
             template_content=template.content,
@@ -249,4 +330,13 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="localhost", port=8000)
\ No newline at end of file
+    # 多进程部署：每个worker各自持有提示词管理器、抽取器与缓存，
+    # 模板的增删改只在处理该请求的进程内存中生效，需要频繁编辑模板时保持单进程
+    uvicorn.run(
+        "app.main:app",
+        host=os.getenv("HOST", "localhost"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        timeout_keep_alive=int(os.getenv("TIMEOUT_KEEP_ALIVE", "30")),
+        limit_concurrency=int(os.getenv("LIMIT_CONCURRENCY", "256"))
+    )
\ No newline at end of file
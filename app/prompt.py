@@ -1,9 +1,9 @@
 import os
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, Template
 from typing import Dict, Any, List
 
 from app.schemas import SchemaItem
-from app.utils import get_allowed_node_types, get_allowed_relations
+from app.utils import get_allowed_types_and_relations
 
 
 class PromptManager:
@@ -13,7 +13,14 @@ class PromptManager:
         :param template_dir: 模板文件夹路径
         """
         self.template_dir = template_dir
-        self.env = Environment(loader=FileSystemLoader(template_dir))
+        # 模板文件在运行期间不变，关闭自动重载并不限制缓存大小
+        self.env = Environment(
+            loader=FileSystemLoader(template_dir),
+            auto_reload=False,
+            cache_size=-1
+        )
+        # 已编译模板缓存：语言 -> Template
+        self._templates: Dict[str, Template] = {}
 
     def load_template(self, lang: str = "zh") -> str:
         """
@@ -38,12 +45,13 @@ class PromptManager:
         :param schema: Schema 信息
         :return: 渲染后的提示词字符串
         """
-        template_name = self.load_template(lang)
-        template = self.env.get_template(template_name)
+        template = self._templates.get(lang)
+        if template is None:
+            template = self.env.get_template(self.load_template(lang))
+            self._templates[lang] = template
 
         # 提取 schema 中允许的节点和关系类型
-        allowed_node_types = get_allowed_node_types(schema.triplet)
-        allowed_relations = get_allowed_relations(schema.triplet)
+        allowed_node_types, allowed_relations = get_allowed_types_and_relations(schema.triplet)
         allowed_triplets = schema.triplet
 
         # 渲染模板
@@ -1,9 +1,21 @@
-import json
+import asyncio
+import ahocorasick
+import os
 import re
-from typing import Dict, Any, List, Tuple
+import numpy as np
+from concurrent.futures import Executor
+from typing import Dict, Any, FrozenSet, List, Optional, Tuple, TypedDict
 from dataclasses import dataclass
 from app.schemas import PromptEvaluationRequest, PromptEvaluationResponse
 from app.kg_extractor import LLMKGExtractor
+from app.prompt_manager import EnhancedPromptManager
+from app.utils import get_allowed_type_sets
+
+# 节点ID格式：类型_编号，例如 person_001
+_ID_RE = re.compile(r'^[a-zA-Z_]+_\d+$')
+
+# 支持的评估指标
+_SUPPORTED_METRICS = ("completeness", "accuracy", "consistency", "relevance")
 
 
 @dataclass
@@ -15,124 +27,110 @@ class EvaluationMetrics:
     relevance: float = 0.0     # 相关性
 
 
-class PromptEvaluator:
-    def __init__(self):
-        """初始化提示词评估器"""
-        self.kg_extractor = LLMKGExtractor()
+class DetailedResult(TypedDict, total=False):
+    """单条测试文本的评估记录"""
+    test_index: int
+    text: str
+    extraction_result: Dict[str, Any]
+    scores: Dict[str, float]
+    error: str
 
-    def evaluate_template(
-        self, 
-        template_id: str,
-        template_name: str,
-        template_content: str,
-        test_texts: List[str],
-        schema_info,
-        evaluation_metrics: List[str]
-    ) -> PromptEvaluationResponse:
-        """
-        评估提示词模板
-        """
-        detailed_results = []
-        total_scores = {metric: 0.0 for metric in evaluation_metrics}
-        
-        for i, text in enumerate(test_texts):
-            try:
-                # 渲染提示词
-                from app.prompt_manager import EnhancedPromptManager
-                temp_manager = EnhancedPromptManager()
-                
-                # 临时设置模板内容
-                temp_template = temp_manager.get_active_template("zh")
-                if temp_template:
-                    temp_template.content = template_content
-                
-                prompt = temp_manager.render_prompt("zh", text, schema_info)
-                
-                # 执行抽取
-                result = self.kg_extractor.extract(prompt)
-                
-                # 评估结果
-                scores = self._evaluate_single_result(
-                    result, text, schema_info, evaluation_metrics
-                )
-                
-                detailed_results.append({
-                    "test_index": i,
-                    "text": text[:100] + "..." if len(text) > 100 else text,
-                    "extraction_result": result,
-                    "scores": scores
-                })
-                
-                # 累加分数
-                for metric in evaluation_metrics:
-                    if metric in scores:
-                        total_scores[metric] += scores[metric]
-                        
-            except Exception as e:
-                detailed_results.append({
-                    "test_index": i,
-                    "text": text[:100] + "..." if len(text) > 100 else text,
-                    "error": str(e),
-                    "scores": {metric: 0.0 for metric in evaluation_metrics}
-                })
-        
-        # 计算平均分数
-        num_tests = len(test_texts)
-        evaluation_results = {
-            metric: total_scores[metric] / num_tests if num_tests > 0 else 0.0
-            for metric in evaluation_metrics
-        }
-        
-        # 生成评估总结
-        summary = self._generate_evaluation_summary(
-            template_name, evaluation_results, detailed_results
-        )
-        
-        return PromptEvaluationResponse(
-            template_id=template_id,
-            template_name=template_name,
-            evaluation_results=evaluation_results,
-            detailed_results=detailed_results,
-            summary=summary
-        )
+
+class ResultScorer:
+    """抽取结果评分：各评分方法不依赖实例状态，可在进程池中执行"""
 
     def _evaluate_single_result(
         self, 
         result: Dict[str, Any], 
         text: str, 
-        schema_info,
+        allowed_types: FrozenSet[str],
+        allowed_relations: FrozenSet[str],
         metrics: List[str]
     ) -> Dict[str, float]:
-        """评估单个抽取结果"""
-        scores = {}
+        """评估单个抽取结果：一次遍历节点与关系收集特征，再计算各项指标"""
+        # 预先按固定顺序放入所有请求的指标，后续只做赋值
+        scores = dict.fromkeys((metric for metric in _SUPPORTED_METRICS if metric in metrics), 0.0)
+        nodes = result.get("nodes", []) if isinstance(result, dict) else []
+        relationships = result.get("relationships", []) if isinstance(result, dict) else []
+        
+        # 未抽取到任何节点和关系时所有指标均为0，无需计算
+        if not nodes and not relationships:
+            return scores
         
         if "completeness" in metrics:
-            scores["completeness"] = self._calculate_completeness(result, text, schema_info)
+            scores["completeness"] = self._calculate_completeness(nodes, relationships, text)
+        
+        try:
+            # 原文只转一次小写，节点名称只匹配一次
+            if "accuracy" in metrics or "relevance" in metrics:
+                full_matches, partial_matches = self._match_node_names(nodes, text.lower())
+            else:
+                full_matches, partial_matches = [], []
+            
+            # 节点特征
+            node_ids = set()
+            node_types = set()
+            node_fields_ok = node_type_ok = id_format_ok = 0
+            for node in nodes:
+                node_id = node.get("id", "")
+                node_type = node.get("type", "")
+                if node_id and node.get("name") and node_type:
+                    node_fields_ok += 1
+                if node_type in allowed_types:
+                    node_type_ok += 1
+                if isinstance(node_id, str) and _ID_RE.match(node_id):
+                    id_format_ok += 1
+                node_ids.add(node_id)
+                node_types.add(node_type)
+            
+            # 关系特征
+            rel_fields_ok = rel_refs_ok = rel_type_ok = 0
+            for rel in relationships:
+                source = rel.get("source", "")
+                target = rel.get("target", "")
+                rel_type = rel.get("type", "")
+                if source and target and rel_type:
+                    rel_fields_ok += 1
+                if source in node_ids and target in node_ids:
+                    rel_refs_ok += 1
+                if rel_type in allowed_relations:
+                    rel_type_ok += 1
+        except Exception:
+            # 结果格式异常（如节点不是对象）时其余指标记0
+            return scores
         
         if "accuracy" in metrics:
-            scores["accuracy"] = self._calculate_accuracy(result, text, schema_info)
+            # 节点：字段齐全0.3 + 名称出现在原文0.4 + 类型合法0.3
+            # 关系：字段齐全0.4 + 引用的节点存在0.3 + 类型合法0.3
+            total = (
+                0.3 * node_fields_ok + 0.4 * sum(full_matches) + 0.3 * node_type_ok
+                + 0.4 * rel_fields_ok + 0.3 * rel_refs_ok + 0.3 * rel_type_ok
+            )
+            scores["accuracy"] = total / (len(nodes) + len(relationships))
         
-        if "consistency" in metrics:
-            scores["consistency"] = self._calculate_consistency(result)
+        if "consistency" in metrics and nodes:
+            # ID格式一致性、类型集中度（全部同类型为1）、关系引用一致性
+            consistency_scores = [
+                id_format_ok / len(nodes),
+                1 - (len(node_types) - 1) / max(len(nodes) - 1, 1)
+            ]
+            if relationships:
+                consistency_scores.append(rel_refs_ok / len(relationships))
+            scores["consistency"] = sum(consistency_scores) / len(consistency_scores)
         
-        if "relevance" in metrics:
-            scores["relevance"] = self._calculate_relevance(result, text)
+        if "relevance" in metrics and nodes:
+            # 完整名称出现在文本中得1分，仅部分词出现得0.5分
+            relevance_scores = np.where(full_matches, 1.0, np.where(partial_matches, 0.5, 0.0))
+            scores["relevance"] = float(relevance_scores.mean())
         
         return scores
 
-    def _calculate_completeness(self, result: Dict[str, Any], text: str, schema_info) -> float:
+    def _calculate_completeness(self, nodes: List[Dict[str, Any]], relationships: List[Dict[str, Any]], text: str) -> float:
         """计算完整性分数"""
         try:
-            nodes = result.get("nodes", [])
-            relationships = result.get("relationships", [])
-            
-            # 检查是否提取了节点和关系
-            if not nodes and not relationships:
-                return 0.0
-            
             # 计算文本中可能存在的实体数量（简单估算）
             # 这里可以根据具体需求调整算法
-            text_entities = self._estimate_entities_in_text(text, schema_info)
+            text_entities = self._estimate_entities_in_text(text)
             
             if text_entities == 0:
                 return 1.0 if nodes else 0.0
@@ -149,169 +147,189 @@ class PromptEvaluator:
         except Exception:
             return 0.0
 
-    def _calculate_accuracy(self, result: Dict[str, Any], text: str, schema_info) -> float:
-        """计算准确性分数"""
-        try:
-            nodes = result.get("nodes", [])
-            relationships = result.get("relationships", [])
-            
-            if not nodes and not relationships:
-                return 0.0
-            
-            accuracy_scores = []
-            
-            # 检查节点准确性
-            for node in nodes:
-                node_score = self._check_node_accuracy(node, text, schema_info)
-                accuracy_scores.append(node_score)
-            
-            # 检查关系准确性
-            for rel in relationships:
-                rel_score = self._check_relationship_accuracy(rel, nodes, text, schema_info)
-                accuracy_scores.append(rel_score)
-            
-            return sum(accuracy_scores) / len(accuracy_scores) if accuracy_scores else 0.0
-            
-        except Exception:
-            return 0.0
-
-    def _calculate_consistency(self, result: Dict[str, Any]) -> float:
-        """计算一致性分数"""
-        try:
-            nodes = result.get("nodes", [])
-            relationships = result.get("relationships", [])
-            
-            if not nodes:
-                return 0.0
-            
-            consistency_scores = []
-            
-            # 检查ID格式一致性
-            id_pattern = re.compile(r'^[a-zA-Z_]+_\d+$')
-            id_consistency = sum(1 for node in nodes if id_pattern.match(node.get("id", ""))) / len(nodes)
-            consistency_scores.append(id_consistency)
-            
-            # 检查类型一致性
-            types = [node.get("type", "") for node in nodes]
-            type_consistency = len(set(types)) / len(types) if types else 0.0
-            consistency_scores.append(type_consistency)
-            
-            # 检查关系引用一致性
-            if relationships and nodes:
-                node_ids = {node.get("id", "") for node in nodes}
-                valid_refs = sum(1 for rel in relationships 
-                               if rel.get("source", "") in node_ids and rel.get("target", "") in node_ids)
-                ref_consistency = valid_refs / len(relationships) if relationships else 1.0
-                consistency_scores.append(ref_consistency)
-            
-            return sum(consistency_scores) / len(consistency_scores) if consistency_scores else 0.0
-            
-        except Exception:
-            return 0.0
-
-    def _calculate_relevance(self, result: Dict[str, Any], text: str) -> float:
-        """计算相关性分数"""
-        try:
-            nodes = result.get("nodes", [])
-            
-            if not nodes:
-                return 0.0
-            
-            relevance_scores = []
-            
-            for node in nodes:
-                name = node.get("name", "")
-                if name:
-                    # 检查实体名称是否在文本中出现
-                    if name.lower() in text.lower():
-                        relevance_scores.append(1.0)
-                    else:
-                        # 检查部分匹配
-                        partial_match = any(word in text.lower() for word in name.lower().split())
-                        relevance_scores.append(0.5 if partial_match else 0.0)
+    def _match_node_names(self, nodes: List[Dict[str, Any]], text_lower: str) -> Tuple[List[bool], List[bool]]:
+        """
+        用Aho-Corasick自动机一次扫描文本，判断每个节点名称是否出现
+        :param nodes: 节点列表
+        :param text_lower: 已转小写的原文
+        :return: (完整名称匹配标记, 名称中任一词匹配标记)
+        """
+        full_matches = [False] * len(nodes)
+        partial_matches = [False] * len(nodes)
+        
+        # 模式串 -> [(节点下标, 是否完整名称)]
+        owners: Dict[str, List[Tuple[int, bool]]] = {}
+        for i, node in enumerate(nodes):
+            name_lower = (node.get("name") or "").lower()
+            if not name_lower:
+                continue
+            owners.setdefault(name_lower, []).append((i, True))
+            for word in name_lower.split():
+                owners.setdefault(word, []).append((i, False))
+        
+        if not owners:
+            return full_matches, partial_matches
+        
+        automaton = ahocorasick.Automaton()
+        for pattern in owners:
+            automaton.add_word(pattern, pattern)
+        automaton.make_automaton()
+        
+        for _, pattern in automaton.iter(text_lower):
+            for i, is_full in owners[pattern]:
+                if is_full:
+                    full_matches[i] = True
                 else:
-                    relevance_scores.append(0.0)
-            
-            return sum(relevance_scores) / len(relevance_scores) if relevance_scores else 0.0
-            
-        except Exception:
-            return 0.0
+                    partial_matches[i] = True
+        return full_matches, partial_matches
 
-    def _estimate_entities_in_text(self, text: str, schema_info) -> int:
+    def _estimate_entities_in_text(self, text: str) -> int:
         """估算文本中可能存在的实体数量"""
         # 简单的实体数量估算
         # 可以根据具体需求使用更复杂的NLP方法
         words = text.split()
         return max(len(words) // 20, 1)  # 假设每20个词包含一个实体
 
-    def _check_node_accuracy(self, node: Dict[str, Any], text: str, schema_info) -> float:
-        """检查节点准确性"""
-        score = 0.0
-        
-        # 检查必要字段
-        if node.get("id") and node.get("name") and node.get("type"):
-            score += 0.3
-        
-        # 检查名称是否在文本中
-        name = node.get("name", "")
-        if name and name.lower() in text.lower():
-            score += 0.4
+
+_SCORER = ResultScorer()
+
+
+def score_result(
+    result: Dict[str, Any],
+    text: str,
+    allowed_types: FrozenSet[str],
+    allowed_relations: FrozenSet[str],
+    metrics: List[str]
+) -> Dict[str, float]:
+    """模块级评分入口，可被pickle后提交到进程池执行"""
+    return _SCORER._evaluate_single_result(result, text, allowed_types, allowed_relations, metrics)
+
+
+class PromptEvaluator(ResultScorer):
+    def __init__(
+        self,
+        kg_extractor: Optional[LLMKGExtractor] = None,
+        prompt_manager: Optional[EnhancedPromptManager] = None,
+        score_executor: Optional[Executor] = None
+    ):
+        """
+        初始化提示词评估器
+        :param kg_extractor: 共享的抽取器实例，未提供时自行创建
+        :param prompt_manager: 共享的提示词管理器，未提供时自行创建
+        :param score_executor: 执行评分的进程池，未提供时在线程中评分
+        """
+        self.kg_extractor = kg_extractor or LLMKGExtractor()
+        self.prompt_manager = prompt_manager or EnhancedPromptManager()
+        self.score_executor = score_executor
+        # 评估时同时发往LLM的最大请求数
+        self.max_concurrency = max(int(os.getenv("EVAL_CONCURRENCY", "8")), 1)
+
+    async def evaluate_template(
+        self, 
+        template_id: str,
+        template_name: str,
+        template_content: str,
+        test_texts: List[str],
+        schema_info,
+        evaluation_metrics: List[str]
+    ) -> PromptEvaluationResponse:
+        """
+        评估提示词模板，所有测试文本的抽取请求并发执行
+        :raises jinja2.TemplateSyntaxError: 模板内容无法编译时在发起任何LLM请求前失败
+        """
+        # 先编译模板，语法错误直接返回，不再为每条文本重复失败
+        self.prompt_manager.compile_content(template_content)
         
-        # 检查类型是否在允许的类型中
-        node_type = node.get("type", "")
-        allowed_types = self._extract_allowed_types(schema_info)
-        if node_type in allowed_types:
-            score += 0.3
+        # schema允许的类型只解析一次，供所有测试文本复用
+        allowed_types, allowed_relations = get_allowed_type_sets(schema_info.triplet)
         
-        return score
-
-    def _check_relationship_accuracy(self, rel: Dict[str, Any], nodes: List[Dict], text: str, schema_info) -> float:
-        """检查关系准确性"""
-        score = 0.0
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = [
+            self._run_one(
+                i, text, template_content, schema_info,
+                allowed_types, allowed_relations, evaluation_metrics, semaphore
+            )
+            for i, text in enumerate(test_texts)
+        ]
+        detailed_results = await asyncio.gather(*tasks)
         
-        # 检查必要字段
-        if rel.get("source") and rel.get("target") and rel.get("type"):
-            score += 0.4
+        # 分数矩阵：行为测试文本，列为评估指标
+        scores_matrix = np.zeros((len(detailed_results), len(evaluation_metrics)))
+        for row, item in enumerate(detailed_results):
+            scores = item["scores"]
+            scores_matrix[row] = [scores.get(metric, 0.0) for metric in evaluation_metrics]
         
-        # 检查源和目标节点是否存在
-        node_ids = {node.get("id", "") for node in nodes}
-        if rel.get("source", "") in node_ids and rel.get("target", "") in node_ids:
-            score += 0.3
+        # 计算平均分数
+        averages = scores_matrix.mean(axis=0).tolist() if len(detailed_results) > 0 else [0.0] * len(evaluation_metrics)
+        evaluation_results = dict(zip(evaluation_metrics, averages))
         
-        # 检查关系类型是否在允许的类型中
-        rel_type = rel.get("type", "")
-        allowed_relations = self._extract_allowed_relations(schema_info)
-        if rel_type in allowed_relations:
-            score += 0.3
+        # 生成评估总结
+        summary = self._generate_evaluation_summary(
+            template_name, evaluation_results, detailed_results
+        )
         
-        return score
-
-    def _extract_allowed_types(self, schema_info) -> List[str]:
-        """提取允许的实体类型"""
-        allowed_types = set()
-        for triplet in schema_info.triplet:
-            parts = triplet.split('-')
-            if len(parts) >= 2:
-                allowed_types.add(parts[0])
-                if '->' in triplet:
-                    target_part = triplet.split('->')[1]
-                    allowed_types.add(target_part)
-        return list(allowed_types)
+        return PromptEvaluationResponse(
+            template_id=template_id,
+            template_name=template_name,
+            evaluation_results=evaluation_results,
+            detailed_results=detailed_results,
+            summary=summary
+        )
 
-    def _extract_allowed_relations(self, schema_info) -> List[str]:
-        """提取允许的关系类型"""
-        allowed_relations = set()
-        for triplet in schema_info.triplet:
-            if '->' in triplet:
-                relation_part = triplet.split('->')[0].split('-', 1)[1]
-                allowed_relations.add(relation_part)
-        return list(allowed_relations)
+    async def _run_one(
+        self,
+        index: int,
+        text: str,
+        template_content: str,
+        schema_info,
+        allowed_types: FrozenSet[str],
+        allowed_relations: FrozenSet[str],
+        evaluation_metrics: List[str],
+        semaphore: asyncio.Semaphore
+    ) -> DetailedResult:
+        """执行单条测试文本的抽取与评分"""
+        short_text = text[:100] + "..." if len(text) > 100 else text
+        try:
+            # 使用待评估的模板内容渲染提示词
+            prompt, user_prompt = self.prompt_manager.render_parts_with_content(
+                template_content, text, schema_info
+            )
+            
+            # 执行抽取，限制同时进行的LLM请求数
+            async with semaphore:
+                result = await self.kg_extractor.aextract(prompt, user_prompt)
+            
+            # 评估结果，评分为CPU计算，放到进程池（或线程）中执行以免阻塞事件循环
+            if self.score_executor is not None:
+                scores = await asyncio.get_running_loop().run_in_executor(
+                    self.score_executor, score_result,
+                    result, text, allowed_types, allowed_relations, evaluation_metrics
+                )
+            else:
+                scores = await asyncio.to_thread(
+                    self._evaluate_single_result,
+                    result, text, allowed_types, allowed_relations, evaluation_metrics
+                )
+            
+            return DetailedResult(
+                test_index=index,
+                text=short_text,
+                extraction_result=result,
+                scores=scores
+            )
+        except Exception as e:
+            return DetailedResult(
+                test_index=index,
+                text=short_text,
+                error=str(e),
+                scores={metric: 0.0 for metric in evaluation_metrics}
+            )
 
     def _generate_evaluation_summary(
         self, 
         template_name: str, 
         evaluation_results: Dict[str, float], 
-        detailed_results: List[Dict[str, Any]]
+        detailed_results: List[DetailedResult]
     ) -> str:
         """生成评估总结"""
         summary_parts = [f"模板 '{template_name}' 的评估结果："]
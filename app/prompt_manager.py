@@ -1,8 +1,12 @@
 import os
-import json
+import orjson
+import threading
+import time
 import uuid
-from datetime import datetime
-from typing import Dict, Any, List, Optional
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Any, Final, FrozenSet, List, Optional, Set, Tuple, Union
 from jinja2 import Environment, Template
 from pathlib import Path
 
@@ -14,59 +18,23 @@ from app.schemas import (
     TemplateSearchRequest,
     TemplateListResponse
 )
-from app.utils import get_allowed_node_types, get_allowed_relations
+from app.template_store import SQLiteTemplateStore, SQLITE_SUFFIXES
+from app.utils import get_allowed_types_and_relations, setup_logger
 
+# 设置日志
+logger = setup_logger(__name__)
 
-class EnhancedPromptManager:
-    def __init__(self, storage_file: str = "prompt_templates.json"):
-        """
-        增强的提示词管理器
-        :param storage_file: 模板存储文件路径
-        """
-        self.storage_file = storage_file
-        self.templates: Dict[str, PromptTemplate] = {}
-        self.default_templates: Dict[str, str] = {}  # language -> template_id
-        self.load_templates()
-        
-        # 初始化默认模板
-        self._init_default_templates()
+# 渲染静态前缀时代替输入文本的占位符（大小写混合，经过滤器处理后可被检测出来）
+_TEXT_SENTINEL = "\x00__KgInputText__\x00"
+_TEXT_PROBE = "\x00__KgProbeText__\x00"
+# 简单模板的占位符：只做字符串替换，不经过Jinja2
+TEXT_PLACEHOLDER = "{TEXT_PLACEHOLDER}"
+TRIPLETS_PLACEHOLDER = "{TRIPLETS_PLACEHOLDER}"
+# 修改后延迟写盘的时间（秒），窗口内的多次修改合并为一次写入
+_FLUSH_DELAY = 0.2
 
-    def _init_default_templates(self):
-        """初始化默认模板"""
-        if not self.templates:
-            # 创建默认的中文模板
-            default_zh_template = PromptTemplate(
-                id=str(uuid.uuid4()),
-                name="默认中文模板",
-                description="系统默认的中文提示词模板",
-                language="zh",
-                content=self._get_default_zh_content(),
-                version="1.0.0",
-                tags=["默认", "中文"],
-                metadata={"is_default": True}
-            )
-            self.templates[default_zh_template.id] = default_zh_template
-            self.default_templates["zh"] = default_zh_template.id
-            
-            # 创建默认的英文模板
-            default_en_template = PromptTemplate(
-                id=str(uuid.uuid4()),
-                name="默认英文模板",
-                description="系统默认的英文提示词模板",
-                language="en",
-                content=self._get_default_en_content(),
-                version="1.0.0",
-                tags=["默认", "英文"],
-                metadata={"is_default": True}
-            )
-            self.templates[default_en_template.id] = default_en_template
-            self.default_templates["en"] = default_en_template.id
-            
-            self.save_templates()
-
-    def _get_default_zh_content(self) -> str:
-        """获取默认中文模板内容"""
-        return """# Knowledge Graph Extraction Prompt 
+# 系统默认的中文提示词模板内容
+_DEFAULT_ZH_CONTENT: Final[str] = """# Knowledge Graph Extraction Prompt 
 
 ## 1. Overview
 你是一个顶级信息抽取模型，专门从非结构化文本中提取结构化信息，用于构建知识图谱。
@@ -99,18 +67,15 @@ class EnhancedPromptManager:
 
 ## 3. Allowed Triplets (三元组限定)
 - 只允许抽取下列三元组类型：
-{% for triplet in allowed_triplets %}
-- {{ triplet }}
-{% endfor %}
+{TRIPLETS_PLACEHOLDER}
 
 ## 4. 输入文本
-{{ text }}
+{TEXT_PLACEHOLDER}
 
 请根据上述要求提取知识图谱。"""
 
-    def _get_default_en_content(self) -> str:
-        """获取默认英文模板内容"""
-        return """# Knowledge Graph Extraction Prompt
+# 系统默认的英文提示词模板内容
+_DEFAULT_EN_CONTENT: Final[str] = """# Knowledge Graph Extraction Prompt
 
 ## 1. Overview
 You are a top-tier information extraction model, specialized in extracting structured information from unstructured text for building knowledge graphs.
@@ -143,39 +108,249 @@ You are a top-tier information extraction model, specialized in extracting struc
 
 ## 3. Allowed Triplets
 - Only extract the following triplet types:
-{% for triplet in allowed_triplets %}
-- {{ triplet }}
-{% endfor %}
+{TRIPLETS_PLACEHOLDER}
 
 ## 4. Input Text
-{{ text }}
+{TEXT_PLACEHOLDER}
 
 Please extract the knowledge graph according to the above requirements."""
 
+
+class EnhancedPromptManager:
+    def __init__(self, storage_file: str = "prompt_templates.json"):
+        """
+        增强的提示词管理器
+        :param storage_file: 模板存储文件路径，以 .db/.sqlite/.sqlite3 结尾时使用SQLite按行存储，否则使用JSON文件
+        """
+        self.storage_file = storage_file
+        self._store = SQLiteTemplateStore(storage_file) if storage_file.endswith(SQLITE_SUFFIXES) else None
+        # 加载时只保存原始dict，首次访问时再通过 _get 转换为 PromptTemplate
+        self.templates: Dict[str, Union[PromptTemplate, Dict[str, Any]]] = {}
+        self.default_templates: Dict[str, str] = {}  # language -> template_id
+        # 所有模板共用一个Jinja2环境
+        self.env = Environment(autoescape=False, cache_size=400)
+        # 模板ID -> (updated_at, 响应模型)，模板更新后失效
+        self._response_cache: Dict[str, Tuple[datetime, PromptTemplateResponse]] = {}
+        # 按内容哈希缓存已编译的临时模板（评估未保存的模板内容时使用）
+        self._content_templates: "OrderedDict[str, Template]" = OrderedDict()
+        # (模板内容, triplet元组) -> (静态系统提示词, 含占位符的用户提示词)
+        self._prompt_parts: "OrderedDict[Tuple[str, Tuple[str, ...]], Optional[Tuple[str, str]]]" = OrderedDict()
+        # 延迟写盘：修改只标记为脏并重置定时器，定时器到期后统一写入
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._flush_timer: Optional[threading.Timer] = None
+        # SQLite存储下只写入发生变化的行
+        self._changed_ids: Set[str] = set()
+        self._deleted_ids: Set[str] = set()
+        # 列表查询用的二级索引：语言/标签 -> 模板ID集合
+        self._by_lang: Dict[str, Set[str]] = {}
+        self._by_tag: Dict[str, Set[str]] = {}
+        # 模板ID -> 标签集合，已按语言过滤时用于逐个判断标签是否相交
+        self._tag_sets: Dict[str, FrozenSet[str]] = {}
+        # 模板ID -> 预先转为小写的 (名称, 描述)，与模板保持相同顺序
+        self._search_text: Dict[str, Tuple[str, str]] = {}
+        # 模板ID -> 插入序号，用于保持列表顺序
+        self._order: Dict[str, int] = {}
+        self._next_order = 0
+        self.load_templates()
+        
+        # 初始化默认模板
+        self._init_default_templates()
+
+    def _init_default_templates(self):
+        """初始化默认模板"""
+        if not self.templates:
+            # 创建默认的中文模板
+            default_zh_template = PromptTemplate(
+                id=_new_template_id(),
+                name="默认中文模板",
+                description="系统默认的中文提示词模板",
+                language="zh",
+                content=_DEFAULT_ZH_CONTENT,
+                version="1.0.0",
+                tags=["默认", "中文"],
+                metadata={"is_default": True, "simple": True}
+            )
+            self.templates[default_zh_template.id] = default_zh_template
+            self.default_templates["zh"] = default_zh_template.id
+            self._changed_ids.add(default_zh_template.id)
+            self._index_template(default_zh_template)
+            
+            # 创建默认的英文模板
+            default_en_template = PromptTemplate(
+                id=_new_template_id(),
+                name="默认英文模板",
+                description="系统默认的英文提示词模板",
+                language="en",
+                content=_DEFAULT_EN_CONTENT,
+                version="1.0.0",
+                tags=["默认", "英文"],
+                metadata={"is_default": True, "simple": True}
+            )
+            self.templates[default_en_template.id] = default_en_template
+            self.default_templates["en"] = default_en_template.id
+            self._changed_ids.add(default_en_template.id)
+            self._index_template(default_en_template)
+            
+            self.save_templates(force=True)
+
     def load_templates(self):
         """从文件加载模板"""
-        if not os.path.exists(self.storage_file):
+        defaults = None
+        if self._store is not None:
+            self.templates = self._store.load()
+            defaults = self._store.load_defaults()
+        elif not os.path.exists(self.storage_file):
             self.templates = {}
+        else:
+            with open(self.storage_file, "rb") as f:
+                data = orjson.loads(f.read())
+            self.templates = data.get("templates", {})
+            defaults = data.get("defaults")
+        if defaults is not None:
+            self.default_templates = dict(defaults)
+        else:
+            # 旧版文件未保存默认模板映射，扫描元数据识别（直接读取原始dict，无需构造模型）
             self.default_templates = {}
-            return
-        with open(self.storage_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            self.templates = {tid: PromptTemplate(**tpl) for tid, tpl in data.get("templates", {}).items()}
-            # 自动识别默认模板
-            self.default_templates = {}
-            for tid, tpl in self.templates.items():
-                if tpl.metadata.get("is_default"):
-                    self.default_templates[tpl.language] = tid
+            for tid, raw in self.templates.items():
+                if (raw.get("metadata") or {}).get("is_default"):
+                    self.default_templates[raw["language"]] = tid
+        self._rebuild_indexes()
+
+    def _sync_default(self, template: PromptTemplate):
+        """按元数据中的 is_default 标记更新语言默认模板映射，与从旧版文件扫描元数据的结果保持一致"""
+        if template.metadata.get("is_default"):
+            self.default_templates[template.language] = template.id
+        elif self.default_templates.get(template.language) == template.id:
+            self._fallback_default(template.language)
+
+    def _fallback_default(self, language: str):
+        """默认模板取消标记或被删除时，退回同语言中其他带标记的模板（与扫描元数据时后出现者优先一致）"""
+        self.default_templates.pop(language, None)
+        for tid, other in self.templates.items():
+            fields = other if isinstance(other, dict) else other.__dict__
+            if fields["language"] == language and (fields.get("metadata") or {}).get("is_default"):
+                self.default_templates[language] = tid
+
+    def _get(self, template_id: str) -> PromptTemplate:
+        """获取模板，必要时把原始dict转换为 PromptTemplate 并替换缓存项"""
+        template = self.templates[template_id]
+        if isinstance(template, dict):
+            # 原始数据来自文件，日期等字段仍为字符串，需要经过校验转换
+            template = PromptTemplate.model_validate(template)
+            self.templates[template_id] = template
+        return template
+
+    def _rebuild_indexes(self):
+        """根据当前模板重建列表查询索引"""
+        self._by_lang.clear()
+        self._by_tag.clear()
+        self._tag_sets.clear()
+        self._search_text.clear()
+        self._order.clear()
+        for template in self.templates.values():
+            self._index_template(template)
+
+    def _index_template(self, template: Union[PromptTemplate, Dict[str, Any]]):
+        """把模板（模型或原始dict）加入列表查询索引"""
+        fields = template if isinstance(template, dict) else template.__dict__
+        template_id = fields["id"]
+        self._by_lang.setdefault(fields["language"], set()).add(template_id)
+        tag_set = frozenset(fields.get("tags", ()))
+        for tag in tag_set:
+            self._by_tag.setdefault(tag, set()).add(template_id)
+        self._tag_sets[template_id] = tag_set
+        self._search_text[template_id] = (fields["name"].lower(), fields.get("description", "").lower())
+        if template_id not in self._order:
+            self._order[template_id] = self._next_order
+            self._next_order += 1
+
+    def _unindex_template(self, template: Union[PromptTemplate, Dict[str, Any]], keep_order: bool = False):
+        """把模板（模型或原始dict）从列表查询索引中移除"""
+        fields = template if isinstance(template, dict) else template.__dict__
+        template_id = fields["id"]
+        ids = self._by_lang.get(fields["language"])
+        if ids is not None:
+            ids.discard(template_id)
+            if not ids:
+                del self._by_lang[fields["language"]]
+        for tag in self._tag_sets.pop(template_id, ()):
+            ids = self._by_tag.get(tag)
+            if ids is not None:
+                ids.discard(template_id)
+                if not ids:
+                    del self._by_tag[tag]
+        if not keep_order:
+            # 更新时保留原位置，重新索引时原地覆盖，使其顺序与模板一致
+            self._search_text.pop(template_id, None)
+            self._order.pop(template_id, None)
 
-    def save_templates(self):
-        """保存模板到文件"""
-        data = {"templates": {tid: tpl.dict() for tid, tpl in self.templates.items()}}
-        with open(self.storage_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    def save_templates(self, force: bool = False):
+        """
+        保存模板到文件
+        :param force: 为True时立即同步写入；否则只标记为脏，由定时器合并写入
+        """
+        with self._lock:
+            self._dirty = True
+            if force:
+                self._flush_locked()
+            else:
+                self._schedule_flush()
+
+    def flush(self):
+        """立即写入尚未落盘的修改，供退出时调用"""
+        with self._lock:
+            if self._dirty:
+                self._flush_locked()
+
+    def _schedule_flush(self):
+        """（重新）启动写盘定时器，窗口内的连续修改只触发一次写入"""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+        self._flush_timer = threading.Timer(_FLUSH_DELAY, self._flush_if_dirty)
+        self._flush_timer.start()
+
+    def _flush_if_dirty(self):
+        with self._lock:
+            # 定时器回调可能与 cancel 竞争，以脏标记为准
+            if not self._dirty:
+                return
+            try:
+                self._flush_locked()
+            except Exception as e:
+                # 定时器线程中的异常无法传回调用方，记录日志；修改仍标记为脏，下次写盘时重试
+                logger.error(f"Error saving prompt templates to {self.storage_file}: {str(e)}")
+
+    def _flush_locked(self):
+        """写入修改：SQLite只写变化的行，JSON整体序列化后一次性写入临时文件并替换；调用方需持有锁"""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._store is not None:
+            changed = [self._get(tid) for tid in self._changed_ids if tid in self.templates]
+            self._store.save(changed, self._deleted_ids - self.templates.keys(), self.default_templates)
+        else:
+            # 未被访问过的模板仍是原始dict，原样写回
+            data = {
+                "templates": {
+                    tid: tpl if isinstance(tpl, dict) else tpl.model_dump()
+                    for tid, tpl in self.templates.items()
+                },
+                "defaults": self.default_templates
+            }
+            payload = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            # 先写临时文件再原子替换，写入中断时不会留下截断的模板文件
+            tmp_file = self.storage_file + ".tmp"
+            with open(tmp_file, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_file, self.storage_file)
+        self._changed_ids.clear()
+        self._deleted_ids.clear()
+        self._dirty = False
 
     def create_template(self, request: CreatePromptTemplateRequest) -> PromptTemplateResponse:
         """创建新模板"""
-        template_id = str(uuid.uuid4())
+        template_id = _new_template_id()
         template = PromptTemplate(
             id=template_id,
             name=request.name,
@@ -187,124 +362,264 @@ Please extract the knowledge graph according to the above requirements."""
             metadata=request.metadata
         )
         
-        self.templates[template_id] = template
-        
-        self.save_templates()
-        return PromptTemplateResponse(**template.dict())
+        with self._lock:
+            self.templates[template_id] = template
+            self._sync_default(template)
+            self._index_template(template)
+            self._changed_ids.add(template_id)
+            self.save_templates()
+        return self._response(template)
 
     def update_template(self, template_id: str, request: UpdatePromptTemplateRequest) -> PromptTemplateResponse:
         """更新模板"""
         if template_id not in self.templates:
             raise ValueError(f"模板不存在: {template_id}")
         
-        template = self.templates[template_id]
-        if request.name is not None:
-            template.name = request.name
-        if request.description is not None:
-            template.description = request.description
-        if request.content is not None:
-            template.content = request.content
-        if request.tags is not None:
-            template.tags = request.tags
-        if request.metadata is not None:
-            template.metadata = request.metadata
-        template.updated_at = datetime.now()
-        self.save_templates()
-        return PromptTemplateResponse(**template.dict())
+        template = self._get(template_id)
+        with self._lock:
+            # 名称、描述和标签可能变化，先移出索引，修改后重新加入（保持原有顺序）
+            self._unindex_template(template, keep_order=True)
+            self._response_cache.pop(template_id, None)
+            if request.name is not None:
+                template.name = request.name
+            if request.description is not None:
+                template.description = request.description
+            if request.content is not None:
+                template.content = request.content
+            if request.tags is not None:
+                template.tags = request.tags
+            if request.metadata is not None:
+                template.metadata = request.metadata
+                self._sync_default(template)
+            template.updated_at = datetime.now()
+            self._index_template(template)
+            self._changed_ids.add(template_id)
+            self.save_templates()
+        return self._response(template)
 
     def delete_template(self, template_id: str) -> bool:
         """删除模板"""
         if template_id not in self.templates:
             return False
         
-        del self.templates[template_id]
-        self.save_templates()
+        with self._lock:
+            removed = self.templates.pop(template_id)
+            self._unindex_template(removed)
+            language = removed["language"] if isinstance(removed, dict) else removed.language
+            if self.default_templates.get(language) == template_id:
+                self._fallback_default(language)
+            self._response_cache.pop(template_id, None)
+            self._changed_ids.discard(template_id)
+            self._deleted_ids.add(template_id)
+            self.save_templates()
         return True
 
+    def _response(self, template: PromptTemplate) -> PromptTemplateResponse:
+        """获取模板的响应模型，模板未更新时复用缓存"""
+        cached = self._response_cache.get(template.id)
+        if cached is not None and cached[0] == template.updated_at:
+            return cached[1]
+        response = _to_response(template)
+        self._response_cache[template.id] = (template.updated_at, response)
+        return response
+
     def get_template(self, template_id: str) -> Optional[PromptTemplateResponse]:
         """获取模板详情"""
         if template_id not in self.templates:
             return None
-        return PromptTemplateResponse(**self.templates[template_id].dict())
+        return self._response(self._get(template_id))
 
     def list_templates(self, request: TemplateSearchRequest) -> TemplateListResponse:
-        """列出模板"""
-        templates = list(self.templates.values())
+        """列出模板：先用语言/标签索引求候选集合，再只在候选中做关键词匹配，最后分页"""
+        candidates: Optional[Set[str]] = None
         
         # 应用过滤条件
         if request.language:
-            templates = [t for t in templates if t.language == request.language]
+            candidates = self._by_lang.get(request.language, set())
         
         if request.tags:
-            templates = [t for t in templates if any(tag in t.tags for tag in request.tags)]
-        
-
+            req_tags = set(request.tags)
+            if candidates is None:
+                candidates = set().union(*(self._by_tag.get(tag, ()) for tag in req_tags))
+            else:
+                # 已按语言缩小范围时，逐个用预先计算的标签集合判断是否相交，无需合并各标签的索引
+                tag_sets = self._tag_sets
+                candidates = {tid for tid in candidates if not req_tags.isdisjoint(tag_sets[tid])}
         
-        if request.keyword:
-            keyword = request.keyword.lower()
-            templates = [t for t in templates if 
-                        keyword in t.name.lower() or 
-                        keyword in t.description.lower()]
+        keyword = request.keyword.lower() if request.keyword else None
+        if candidates is None:
+            if keyword:
+                # 无其他过滤条件时直接遍历小写字段，省去构造全量ID列表与逐个查找
+                template_ids = [tid for tid, (name_lc, desc_lc) in self._search_text.items()
+                                if keyword in name_lc or keyword in desc_lc]
+            else:
+                template_ids = list(self.templates)
+        else:
+            # 按插入顺序排列候选，与未过滤时的顺序保持一致
+            template_ids = sorted(candidates, key=self._order.__getitem__)
+            if keyword:
+                search_text = self._search_text
+                template_ids = [tid for tid in template_ids
+                                if keyword in search_text[tid][0] or keyword in search_text[tid][1]]
         
-        # 分页
-        total = len(templates)
-        start = (request.page - 1) * request.page_size
+        # 分页：指定游标时从该模板之后开始，否则按页码
+        total = len(template_ids)
+        if request.after_id is not None:
+            start = self._cursor_start(template_ids, request.after_id)
+        else:
+            start = (request.page - 1) * request.page_size
         end = start + request.page_size
-        templates = templates[start:end]
+        templates = [self._get(tid) for tid in template_ids[start:end]]
         
         return TemplateListResponse(
-            templates=[PromptTemplateResponse(**t.dict()) for t in templates],
+            templates=[self._response(t) for t in templates],
             total=total,
             page=request.page,
             page_size=request.page_size
         )
 
+    def _cursor_start(self, template_ids: List[str], after_id: str) -> int:
+        """
+        计算游标之后第一个结果在候选列表中的位置
+        :raises ValueError: 游标既不是现存模板，也不是可比较的时间有序ID
+        """
+        order = self._order
+        if after_id in order:
+            # 候选已按插入顺序排列，二分查找游标位置
+            after = order[after_id]
+            start, hi = 0, len(template_ids)
+            while start < hi:
+                mid = (start + hi) // 2
+                if order[template_ids[mid]] <= after:
+                    start = mid + 1
+                else:
+                    hi = mid
+            return start
+        if not _is_time_ordered_id(after_id):
+            raise ValueError(f"模板不存在: {after_id}")
+        # 游标模板已被删除：按ID大小找到其后创建的第一个模板，旧格式ID视为更早
+        after_id = after_id.lower()
+        for index, template_id in enumerate(template_ids):
+            if _is_time_ordered_id(template_id) and template_id > after_id:
+                return index
+        return len(template_ids)
+
     def get_default_template(self, language: str) -> Optional[PromptTemplate]:
         """获取指定语言的默认模板"""
         if language not in self.default_templates:
             return None
         
         template_id = self.default_templates[language]
-        return self.templates.get(template_id)
+        if template_id not in self.templates:
+            return None
+        return self._get(template_id)
 
-    def render_prompt(self, language: str, text: str, schema_info, template_id: Optional[str] = None) -> str:
-        """渲染提示词"""
+    def _resolve_template(self, language: str, template_id: Optional[str]) -> PromptTemplate:
+        """按模板ID或语言默认模板查找渲染所用的模板"""
         # 如果指定了模板ID，使用指定模板
         if template_id:
             if template_id not in self.templates:
                 raise ValueError(f"模板不存在: {template_id}")
-            template = self.templates[template_id]
-        else:
-            # 否则使用默认模板
-            template = self.get_default_template(language)
-            if not template:
-                raise ValueError(f"未找到语言 '{language}' 的默认模板")
+            return self._get(template_id)
         
-        # 创建Jinja2环境
-        env = Environment()
-        jinja_template = env.from_string(template.content)
+        # 否则使用默认模板
+        template = self.get_default_template(language)
+        if not template:
+            raise ValueError(f"未找到语言 '{language}' 的默认模板")
+        return template
+
+    def render_prompt(self, language: str, text: str, schema_info, template_id: Optional[str] = None) -> str:
+        """渲染提示词"""
+        template = self._resolve_template(language, template_id)
+        return self.render_with_content(template.content, text, schema_info)
+
+    def render_with_content(self, template_content: str, text: str, schema_info) -> str:
+        """直接使用给定的模板内容渲染提示词，简单模板只做字符串替换"""
+        if _is_simple(template_content):
+            return _render_simple(template_content, text, schema_info.triplet)
+        return self._render(self.compile_content(template_content), text, schema_info, template_content)
+
+    def render_prompt_parts(
+        self,
+        language: str,
+        text: str,
+        schema_info,
+        template_id: Optional[str] = None
+    ) -> Tuple[str, str]:
+        """
+        渲染提示词并拆分为 (系统提示词, 用户提示词)
+        系统提示词只包含模板与schema，对同一模板和schema保持不变，便于服务端前缀缓存命中
+        """
+        template = self._resolve_template(language, template_id)
+        return self.render_parts_with_content(template.content, text, schema_info)
+
+    def render_parts_with_content(self, template_content: str, text: str, schema_info) -> Tuple[str, str]:
+        """
+        使用给定的模板内容渲染并拆分提示词
+        以输入文本首次出现的位置为界：之前为静态系统提示词，之后（含文本）为用户提示词，
+        两者拼接即为完整提示词
+        """
+        key = (template_content, tuple(schema_info.triplet))
+        if key in self._prompt_parts:
+            parts = self._prompt_parts[key]
+            self._prompt_parts.move_to_end(key)
+        else:
+            rendered = self.render_with_content(template_content, _TEXT_SENTINEL, schema_info)
+            prefix, sep, suffix = rendered.partition(_TEXT_SENTINEL)
+            parts = (prefix, sep + suffix) if sep else None
+            # 模板未原样输出文本（如未引用、经过过滤器或条件判断）时无法拆分，退回整体渲染
+            if parts is not None:
+                probe = self.render_with_content(template_content, _TEXT_PROBE, schema_info)
+                if probe != prefix + parts[1].replace(_TEXT_SENTINEL, _TEXT_PROBE):
+                    parts = None
+            self._prompt_parts[key] = parts
+            if len(self._prompt_parts) > 256:
+                self._prompt_parts.popitem(last=False)
         
-        # 提取schema信息
-        allowed_node_types = get_allowed_node_types(schema_info.triplet)
-        allowed_relations = get_allowed_relations(schema_info.triplet)
-        allowed_triplets = schema_info.triplet
+        if parts is None:
+            return self.render_with_content(template_content, text, schema_info), ""
+        system_prompt, user_template = parts
+        return system_prompt, user_template.replace(_TEXT_SENTINEL, text)
+
+    def compile_content(self, template_content: str) -> Template:
+        """
+        编译模板内容，结果按内容哈希缓存
+        :raises jinja2.TemplateSyntaxError: 模板语法错误
+        """
+        key = hashlib.sha256(template_content.encode("utf-8")).hexdigest()
+        jinja_template = self._content_templates.get(key)
+        if jinja_template is None:
+            jinja_template = self.env.from_string(template_content)
+            self._content_templates[key] = jinja_template
+            if len(self._content_templates) > 128:
+                self._content_templates.popitem(last=False)
+        else:
+            self._content_templates.move_to_end(key)
+        return jinja_template
+
+    def _render(self, jinja_template: Template, text: str, schema_info, template_content: str) -> str:
+        """
+        使用schema信息渲染已编译的模板
+        :param template_content: 模板源码，用于判断是否需要节点类型与关系类型
+        """
+        context = {"text": text, "allowed_triplets": schema_info.triplet}
+        # 模板未引用节点类型与关系类型时跳过解析（默认模板只使用 allowed_triplets）
+        if "allowed_node_types" in template_content or "allowed_relations" in template_content:
+            allowed_node_types, allowed_relations = get_allowed_types_and_relations(schema_info.triplet)
+            context["allowed_node_types"] = allowed_node_types
+            context["allowed_relations"] = allowed_relations
         
         # 渲染模板
-        return jinja_template.render(
-            text=text,
-            allowed_node_types=allowed_node_types,
-            allowed_relations=allowed_relations,
-            allowed_triplets=allowed_triplets
-        )
+        return jinja_template.render(**context)
 
     def duplicate_template(self, template_id: str, new_name: str) -> PromptTemplateResponse:
         """复制模板"""
         if template_id not in self.templates:
             raise ValueError(f"模板不存在: {template_id}")
         
-        original = self.templates[template_id]
+        original = self._get(template_id)
         new_template = PromptTemplate(
-            id=str(uuid.uuid4()),
+            id=_new_template_id(),
             name=new_name,
             description=f"复制自: {original.name}",
             language=original.language,
@@ -314,9 +629,13 @@ Please extract the knowledge graph according to the above requirements."""
             metadata=original.metadata
         )
         
-        self.templates[new_template.id] = new_template
-        self.save_templates()
-        return PromptTemplateResponse(**new_template.dict())
+        with self._lock:
+            self.templates[new_template.id] = new_template
+            self._sync_default(new_template)
+            self._index_template(new_template)
+            self._changed_ids.add(new_template.id)
+            self.save_templates()
+        return self._response(new_template)
 
     def get_template_statistics(self) -> Dict[str, Any]:
         """获取模板统计信息"""
@@ -328,21 +647,115 @@ Please extract the knowledge graph according to the above requirements."""
             "recent_updated": 0
         }
         
-        # 按语言统计
-        for template in self.templates.values():
-            lang = template.language
-            if lang not in stats["languages"]:
-                stats["languages"][lang] = {"total": 0, "default": 0}
-            stats["languages"][lang]["total"] += 1
-            if template.id in self.default_templates.values():
-                stats["languages"][lang]["default"] += 1
-        
-        # 最近创建和更新的模板数量
-        now = datetime.now()
-        for template in self.templates.values():
-            if (now - template.created_at).days <= 7:
-                stats["recent_created"] += 1
-            if (now - template.updated_at).days <= 7:
-                stats["recent_updated"] += 1
+        # 一次遍历同时统计语言分布和最近创建/更新的模板数量
+        default_ids = set(self.default_templates.values())
+        # 与 (now - t).days <= 7 等价：距今不足8天
+        recent_cutoff = datetime.now() - timedelta(days=8)
+        languages = stats["languages"]
+        recent_created = recent_updated = 0
+        for template_id, template in self.templates.items():
+            # 直接读取原始dict中的字段，统计时不把懒加载的模板转换为 PromptTemplate
+            fields = template if isinstance(template, dict) else template.__dict__
+            created_at = _as_datetime(fields.get("created_at"))
+            updated_at = _as_datetime(fields.get("updated_at"))
+            if created_at is None or updated_at is None:
+                # 非ISO格式的时间交给模型校验解析
+                fields = self._get(template_id).__dict__
+                created_at, updated_at = fields["created_at"], fields["updated_at"]
+            lang_stats = languages.setdefault(fields["language"], {"total": 0, "default": 0})
+            lang_stats["total"] += 1
+            if template_id in default_ids:
+                lang_stats["default"] += 1
+            if created_at > recent_cutoff:
+                recent_created += 1
+            if updated_at > recent_cutoff:
+                recent_updated += 1
+        stats["recent_created"] = recent_created
+        stats["recent_updated"] = recent_updated
         
-        return stats 
\ No newline at end of file
+        return stats 
+
+
+# 生成时间有序ID的状态：同一毫秒内递增计数，保证单进程内严格递增
+_id_lock = threading.Lock()
+_last_id_ms = 0
+_id_counter = 0
+
+
+def _new_template_id() -> str:
+    """
+    生成UUIDv7格式的模板ID：高位为毫秒时间戳（同一毫秒内附加递增计数），低位为随机数
+    字符串按字典序比较即为创建顺序，随机部分保证多进程同时创建时不会冲突
+    """
+    global _last_id_ms, _id_counter
+    with _id_lock:
+        ms = time.time_ns() // 1_000_000
+        if ms <= _last_id_ms:
+            ms = _last_id_ms
+            _id_counter += 1
+            if _id_counter > 0xFFF:
+                ms += 1
+                _id_counter = 0
+        else:
+            _id_counter = 0
+        _last_id_ms = ms
+        counter = _id_counter
+    rand = int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+    value = (ms << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | rand
+    return str(uuid.UUID(int=value))
+
+
+def _is_time_ordered_id(template_id: str) -> bool:
+    """判断是否为 _new_template_id 生成的UUIDv7格式ID"""
+    try:
+        return uuid.UUID(template_id).version == 7 and len(template_id) == 36
+    except ValueError:
+        return False
+
+
+def _to_response(template: PromptTemplate) -> PromptTemplateResponse:
+    """模板数据已经过校验，直接构造响应模型，跳过 dict() 展开与重复校验"""
+    return PromptTemplateResponse.model_construct(**template.__dict__)
+
+
+def _as_datetime(value: Any) -> Optional[datetime]:
+    """把原始数据中的时间字段转换为 datetime，无法按ISO格式解析时返回 None"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _is_simple(template_content: str) -> bool:
+    """模板只使用简单占位符、不含Jinja2语法时可直接做字符串替换"""
+    return (TEXT_PLACEHOLDER in template_content
+            and "{{" not in template_content
+            and "{%" not in template_content)
+
+
+def _render_simple(template_content: str, text: str, triplets: List[str]) -> str:
+    """用字符串替换渲染简单模板"""
+    return (template_content
+            .replace(TRIPLETS_PLACEHOLDER, "\n".join(f"- {triplet}" for triplet in triplets))
+            .replace(TEXT_PLACEHOLDER, text))
+
+
+if __name__ == "__main__":
+    # 回归检查：复制默认模板后删除副本，默认模板应退回原模板，且重启后保持不变
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage_file = os.path.join(tmp_dir, "prompt_templates.json")
+        manager = EnhancedPromptManager(storage_file)
+        original_id = manager.default_templates["zh"]
+        copy = manager.duplicate_template(original_id, "copy")
+        assert manager.default_templates["zh"] == copy.id
+        manager.delete_template(copy.id)
+        assert manager.default_templates["zh"] == original_id
+        manager.flush()
+        assert EnhancedPromptManager(storage_file).default_templates["zh"] == original_id
+        print("OK: duplicate default -> delete copy keeps the original default")
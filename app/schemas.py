@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import List, Dict, Any, Optional
 from typing_extensions import Literal
 from datetime import datetime
@@ -30,6 +30,26 @@ class ExtractionResponse(BaseModel):
     nodes: List[Node] = Field(..., description="List of extracted nodes")
     relationships: List[Relationship] = Field(..., description="List of extracted relationships")
 
+# 模板以 orjson 持久化，只支持64位范围内的整数
+_INT_MIN = -(2 ** 63)
+_INT_MAX = 2 ** 64 - 1
+
+
+def _check_int_range(value: Any) -> Any:
+    """递归检查元数据中的整数是否超出64位范围，超出时拒绝请求而不是在写盘时失败"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        if not _INT_MIN <= value <= _INT_MAX:
+            raise ValueError(f"整数超出64位范围: {value}")
+    elif isinstance(value, dict):
+        for item in value.values():
+            _check_int_range(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _check_int_range(item)
+    return value
+
 # 新增的提示词管理相关模型
 class PromptTemplate(BaseModel):
     id: str = Field(..., description="模板唯一标识符")
@@ -51,6 +71,8 @@ class CreatePromptTemplateRequest(BaseModel):
     tags: List[str] = Field(default_factory=list, description="标签列表")
     metadata: Dict[str, Any] = Field(default_factory=dict, description="元数据")
 
+    _check_metadata = field_validator("metadata")(_check_int_range)
+
 class UpdatePromptTemplateRequest(BaseModel):
     name: Optional[str] = Field(None, description="模板名称")
     description: Optional[str] = Field(None, description="模板描述")
@@ -58,6 +80,8 @@ class UpdatePromptTemplateRequest(BaseModel):
     tags: Optional[List[str]] = Field(None, description="标签列表")
     metadata: Optional[Dict[str, Any]] = Field(None, description="元数据")
 
+    _check_metadata = field_validator("metadata")(_check_int_range)
+
 class PromptTemplateResponse(BaseModel):
     id: str
     name: str
@@ -93,4 +117,5 @@ class TemplateSearchRequest(BaseModel):
     tags: Optional[List[str]] = Field(None, description="标签过滤")
     keyword: Optional[str] = Field(None, description="关键词搜索")
     page: int = Field(1, description="页码")
-    page_size: int = Field(10, description="每页数量")
\ No newline at end of file
+    page_size: int = Field(10, description="每页数量")
+    after_id: Optional[str] = Field(None, description="游标：返回该模板之后的结果，指定时忽略页码")
\ No newline at end of file
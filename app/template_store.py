@@ -0,0 +1,115 @@
+import sqlite3
+import orjson
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.schemas import PromptTemplate
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    id TEXT PRIMARY KEY,
+    language TEXT NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    version TEXT NOT NULL DEFAULT '1.0.0',
+    tags_json TEXT NOT NULL DEFAULT '[]',
+    metadata_json TEXT NOT NULL DEFAULT '{}',
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    is_default INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_templates_language ON templates(language);
+CREATE INDEX IF NOT EXISTS idx_templates_updated_at ON templates(updated_at);
+CREATE TABLE IF NOT EXISTS defaults (
+    language TEXT PRIMARY KEY,
+    template_id TEXT NOT NULL
+);
+"""
+
+_UPSERT = """
+INSERT INTO templates (id, language, name, description, version, tags_json, metadata_json,
+                       content, created_at, updated_at, is_default)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    language = excluded.language,
+    name = excluded.name,
+    description = excluded.description,
+    version = excluded.version,
+    tags_json = excluded.tags_json,
+    metadata_json = excluded.metadata_json,
+    content = excluded.content,
+    updated_at = excluded.updated_at,
+    is_default = excluded.is_default
+"""
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+
+class SQLiteTemplateStore:
+    def __init__(self, path: str):
+        """
+        基于SQLite的模板存储，每个模板一行，修改时只写入变化的行
+        :param path: 数据库文件路径
+        """
+        self.path = path
+        # 写入发生在延迟写盘的定时器线程中，由调用方的锁保证串行访问
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """加载全部模板的原始数据，由调用方按需转换为 PromptTemplate"""
+        rows = self.conn.execute(
+            "SELECT id, language, name, description, version, tags_json, metadata_json, "
+            "content, created_at, updated_at FROM templates ORDER BY created_at"
+        ).fetchall()
+        templates = {}
+        for (tid, language, name, description, version, tags_json, metadata_json,
+             content, created_at, updated_at) in rows:
+            templates[tid] = {
+                "id": tid,
+                "name": name,
+                "description": description,
+                "language": language,
+                "content": content,
+                "version": version,
+                "created_at": created_at,
+                "updated_at": updated_at,
+                "tags": orjson.loads(tags_json),
+                "metadata": orjson.loads(metadata_json)
+            }
+        return templates
+
+    def load_defaults(self) -> Optional[Dict[str, str]]:
+        """读取保存的各语言默认模板ID；尚未保存过映射时返回 None，由调用方扫描元数据"""
+        rows = self.conn.execute("SELECT language, template_id FROM defaults").fetchall()
+        return dict(rows) if rows else None
+
+    def save(
+        self,
+        templates: Iterable[PromptTemplate],
+        deleted_ids: Iterable[str] = (),
+        defaults: Optional[Dict[str, str]] = None
+    ):
+        """在一个事务中写入变化的模板、删除已移除的模板，并替换默认模板映射"""
+        rows: List[tuple] = [
+            (t.id, t.language, t.name, t.description, t.version,
+             orjson.dumps(t.tags).decode(), orjson.dumps(t.metadata).decode(), t.content,
+             t.created_at.isoformat(), t.updated_at.isoformat(), int(bool(t.metadata.get("is_default"))))
+            for t in templates
+        ]
+        with self.conn:
+            if rows:
+                self.conn.executemany(_UPSERT, rows)
+            deleted = [(tid,) for tid in deleted_ids]
+            if deleted:
+                self.conn.executemany("DELETE FROM templates WHERE id = ?", deleted)
+            if defaults is not None:
+                self.conn.execute("DELETE FROM defaults")
+                self.conn.executemany(
+                    "INSERT INTO defaults (language, template_id) VALUES (?, ?)", list(defaults.items())
+                )
+
+    def close(self):
+        self.conn.close()
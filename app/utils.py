@@ -1,6 +1,6 @@
-import re
 import logging
-from typing import List, Optional
+from functools import lru_cache
+from typing import FrozenSet, List, Optional, Sequence, Tuple
 
 # 配置日志
 logging.basicConfig(
@@ -21,9 +21,9 @@ def extract_entity_type_from_triplet(triplet: str) -> Optional[str]:
     """
     从 triplet 中提取实体类型，例如 "Person-HAS_PHONE->Phone" → "Person"
     """
-    match = re.match(r"([A-Za-z0-9_]+)-", triplet)
-    if match:
-        return match.group(1)
+    parts = _split_triplet(triplet)
+    if parts:
+        return parts[0]
     return None
 
 
@@ -31,9 +31,9 @@ def extract_relation_type(triplet: str) -> Optional[str]:
     """
     从 triplet 中提取关系类型，例如 "Person-HAS_PHONE->Phone" → "HAS_PHONE"
     """
-    match = re.search(r"-([A-Za-z0-9_]+)->", triplet)
-    if match:
-        return match.group(1)
+    parts = _split_triplet(triplet)
+    if parts:
+        return parts[1]
     return None
 
 
@@ -41,37 +41,68 @@ def extract_target_type(triplet: str) -> Optional[str]:
     """
     从 triplet 中提取目标类型，例如 "Person-HAS_PHONE->Phone" → "Phone"
     """
-    match = re.search(r"->([A-Za-z0-9_]+)", triplet)
-    if match:
-        return match.group(1)
+    parts = _split_triplet(triplet)
+    if parts:
+        return parts[2]
     return None
 
 
-def get_allowed_node_types(schema_triplets: List[str]) -> List[str]:
+def _split_triplet(triplet: str) -> Optional[Tuple[str, str, str]]:
+    """
+    把 "源类型-关系类型->目标类型" 拆分为三个字段，格式不符或字段为空时返回 None
+    """
+    src, sep, rest = triplet.partition("-")
+    if not sep:
+        return None
+    rel, sep, tgt = rest.partition("->")
+    if not sep or not src or not rel or not tgt:
+        return None
+    return src, rel, tgt
+
+
+def get_allowed_node_types(schema_triplets: Sequence[str]) -> List[str]:
     """
     从 schema 的 triplet 中提取所有允许的节点类型
     """
-    node_types = set()
-    for triplet in schema_triplets:
-        src = extract_entity_type_from_triplet(triplet)
-        tgt = extract_target_type(triplet)
-        if src:
-            node_types.add(src)
-        if tgt:
-            node_types.add(tgt)
-    return sorted(list(node_types))
+    return list(_parse_triplets(tuple(schema_triplets))[0])
 
 
-def get_allowed_relations(schema_triplets: List[str]) -> List[str]:
+def get_allowed_relations(schema_triplets: Sequence[str]) -> List[str]:
     """
     从 schema 的 triplet 中提取所有允许的关系类型
     """
+    return list(_parse_triplets(tuple(schema_triplets))[1])
+
+
+def get_allowed_types_and_relations(schema_triplets: Sequence[str]) -> Tuple[List[str], List[str]]:
+    """
+    一次解析同时得到允许的节点类型和关系类型
+    """
+    node_types, relations = _parse_triplets(tuple(schema_triplets))
+    return list(node_types), list(relations)
+
+
+def get_allowed_type_sets(schema_triplets: Sequence[str]) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+    """
+    以集合形式返回允许的节点类型和关系类型，便于评分时做成员判断
+    """
+    node_types, relations = _parse_triplets(tuple(schema_triplets))
+    return frozenset(node_types), frozenset(relations)
+
+
+@lru_cache(maxsize=512)
+def _parse_triplets(schema_triplets: Tuple[str, ...]) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """按 triplet 元组缓存解析结果，单次遍历得到 (节点类型, 关系类型)，均已排序"""
+    node_types = set()
     relations = set()
     for triplet in schema_triplets:
-        rel = extract_relation_type(triplet)
-        if rel:
+        parts = _split_triplet(triplet)
+        if parts:
+            src, rel, tgt = parts
+            node_types.add(src)
+            node_types.add(tgt)
             relations.add(rel)
-    return sorted(list(relations))
+    return tuple(sorted(node_types)), tuple(sorted(relations))
 
 
 def setup_logger(name: str, level: int = logging.INFO) -> logging.Logger: